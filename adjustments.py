@@ -0,0 +1,235 @@
+import threading
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+from profiling import timed
+from tiling import TILE_PIXELS, run_tiled, should_tile, tile_boxes
+
+SHARPEN_KERNEL = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
+IDENTITY_LUT = np.arange(256, dtype=np.uint8)
+IDENTITY_LUT.setflags(write=False)
+
+# PIL's "L" conversion, (R*19595 + G*38470 + B*7471 + 0x8000) >> 16, as a cv2.transform row. Every term
+# is a multiple of 2^-16 below 256, so float32 holds the weighted sum exactly and floor() is PIL's rounding.
+LUMA_WEIGHTS = [19595 / 65536, 38470 / 65536, 7471 / 65536]
+LUMA_TRANSFORMS = {3: np.array([LUMA_WEIGHTS + [0.5]]), 4: np.array([LUMA_WEIGHTS + [0, 0.5]])}
+
+# calcHist counts in float32, so large images are histogrammed in bands that stay exact
+HIST_BAND_PIXELS = 1 << 22
+
+# scratch up to a tile (plus its halo rows) is kept per thread; anything bigger is freed after the call,
+# so long-lived worker threads never pin full-image buffers outside the cache budgets
+SCRATCH_MAX_PIXELS = 2 * TILE_PIXELS
+
+_scratch = threading.local()
+
+# per-thread scratch buffers, reused while the image size stays the same
+def _buffer(name, shape):
+    if shape[0] * shape[1] > SCRATCH_MAX_PIXELS:
+        return np.empty(shape, dtype=np.uint8)
+    buf = getattr(_scratch, name, None)
+    if buf is None or buf.shape != shape:
+        buf = np.empty(shape, dtype=np.uint8)
+        setattr(_scratch, name, buf)
+    return buf
+
+# table form of PIL's ImageEnhance blend against a flat degenerate value (float math, truncated)
+def _blend_table(table, degenerate, factor):
+    values = np.float32(degenerate) + np.float32(factor) * (table.astype(np.float32) - np.float32(degenerate))
+    return np.clip(values, 0, 255).astype(np.uint8)
+
+@lru_cache(maxsize=64)
+def brightness_lut(brightness):
+    lut = _blend_table(IDENTITY_LUT, 0, brightness)
+    lut.setflags(write=False)
+    return lut
+
+@lru_cache(maxsize=64)
+def gamma_lut(gamma):
+    invGamma = 1.0 / gamma if gamma > 0 else float("inf")
+    lut = np.array([((i / 255.0) ** invGamma) * 255 for i in np.arange(0, 256)]).astype("uint8")
+    lut.setflags(write=False)
+    return lut
+
+@lru_cache(maxsize=64)
+def saturation_lut(saturation):
+    lut = np.clip(np.arange(256) * saturation, 0, 255).astype(np.uint8)
+    # hue and value pass through, only the S plane of HSV is scaled
+    lut = np.dstack([IDENTITY_LUT, lut, IDENTITY_LUT]).reshape(256, 1, 3)
+    lut.setflags(write=False)
+    return lut
+
+# sum of PIL's rounded "L" values over an image after a tone curve
+def luma_sum(img, lut=IDENTITY_LUT):
+    if img.ndim == 2:
+        return int(np.bincount(img.ravel(), minlength=256) @ lut.astype(np.int64))
+    luma = cv2.transform(cv2.LUT(img, lut).astype(np.float32), LUMA_TRANSFORMS[img.shape[2]])
+    np.floor(luma, out=luma)
+    return int(cv2.sumElems(luma)[0])
+
+# Mean of PIL's "L" conversion after a tone curve. Every pixel is rounded to L first, as ImageStat
+# sees it, so int(mean + 0.5) picks the same contrast midpoint PIL does. The sums are taken per tile,
+# on the pool when `tiled`, which keeps the float32 temporaries tile-sized either way.
+def mean_luma(img, lut=IDENTITY_LUT, tiled=False):
+    height, width = img.shape[:2]
+
+    def band_sum(inner, outer):
+        y0, y1 = inner[:2]
+        return luma_sum(img[y0:y1], lut)
+
+    if tiled:
+        sums = run_tiled(band_sum, height, width)
+    else:
+        sums = [band_sum(inner, outer) for inner, outer in tile_boxes(height, width)]
+    return sum(sums) / (height * width)
+
+# exact integer histogram of the YCrCb luma plane
+def luma_histogram(img):
+    height, width = img.shape[:2]
+    rows = max(1, HIST_BAND_PIXELS // width)
+    hist = np.zeros(256, dtype=np.int64)
+    buf = _buffer("color", (min(rows, height), width, 3))
+    for y in range(0, height, rows):
+        band = img[y:y + rows]
+        ycrcb = buf[:band.shape[0]]
+        cv2.cvtColor(band, cv2.COLOR_RGB2YCrCb, dst=ycrcb)
+        hist += cv2.calcHist([ycrcb], [0], None, [256], [0, 256]).ravel().astype(np.int64)
+    return hist
+
+# the table cv2.equalizeHist derives from a histogram, so it can be built from summed tile histograms
+def equalization_lut(hist):
+    lut = np.zeros(256, dtype=np.uint8)
+    first = int(np.flatnonzero(hist)[0])
+    total = int(hist.sum())
+    if hist[first] == total:
+        lut[:] = first
+        return lut
+    scale = np.float32(255.0) / np.float32(total - hist[first])
+    sums = np.cumsum(hist[first + 1:]).astype(np.float32)
+    lut[first + 1:] = np.clip(np.rint(sums * scale), 0, 255)
+    return lut
+
+# histogram equalization of the luma plane through a precomputed table
+def equalize_luma(img, lut, out):
+    ycrcb = _buffer("color", img.shape[:2] + (3,))
+    cv2.cvtColor(img, cv2.COLOR_RGB2YCrCb, dst=ycrcb)
+    cv2.LUT(ycrcb, np.dstack([lut, IDENTITY_LUT, IDENTITY_LUT]).reshape(256, 1, 3), dst=ycrcb)
+    cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2RGB, dst=out, dstCn=out.shape[2])
+    return out
+
+# one LUT per channel, alpha (when present) passed through untouched
+def _channel_lut(lut, channels):
+    if channels != 4:
+        return lut
+    return np.dstack([lut, lut, lut, IDENTITY_LUT]).reshape(256, 1, 4)
+
+# adjustment parameters folded into lookup tables for one image
+class AdjustmentPipeline:
+    def __init__(self, img, brightness=1.0, contrast=1.0, saturation=1.0, sharpness=1.0, gamma=1.0, equalize_hist=False, tiled=False):
+        self.channels = 1 if img.ndim == 2 else img.shape[2]
+
+        tone = brightness_lut(brightness) if brightness != 1.0 else IDENTITY_LUT
+        if contrast != 1.0:
+            # ImageEnhance.Contrast blends toward the rounded mean luma of its input
+            mean = int(mean_luma(img, tone, tiled) + 0.5)
+            tone = _blend_table(tone, mean, contrast)
+
+        self.saturation_lut = saturation_lut(saturation) if saturation != 1.0 else None
+        self.kernel = SHARPEN_KERNEL * sharpness if sharpness != 1.0 else None
+        self.equalize_hist = equalize_hist
+
+        # gamma folds into the same table unless a non pointwise stage sits between them
+        post = gamma_lut(gamma) if gamma != 1.0 else None
+        if post is not None and self.saturation_lut is None and self.kernel is None:
+            tone, post = post[tone], None
+        self.tone_lut = None if np.array_equal(tone, IDENTITY_LUT) else _channel_lut(tone, self.channels)
+        self.gamma_lut = None if post is None else _channel_lut(post, self.channels)
+
+    # pixels of context each side a tile needs for the neighbourhood stages
+    @property
+    def halo(self):
+        return 1 if self.kernel is not None else 0
+
+    # every stage except equalization, which needs the histogram of the whole result
+    def apply_local(self, img, out):
+        height, width = img.shape[:2]
+
+        # sharpening can't run in place, so the pointwise stages go to scratch first
+        stage = _buffer("stage", img.shape) if self.kernel is not None else out
+        if self.tone_lut is not None:
+            cv2.LUT(img, self.tone_lut, dst=stage)
+        else:
+            np.copyto(stage, img)
+
+        if self.saturation_lut is not None:
+            hsv = _buffer("color", (height, width, 3))
+            cv2.cvtColor(stage, cv2.COLOR_RGB2HSV, dst=hsv)
+            cv2.LUT(hsv, self.saturation_lut, dst=hsv)
+            cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB, dst=stage, dstCn=self.channels)
+
+        if self.kernel is not None:
+            cv2.filter2D(stage, -1, self.kernel, dst=out)
+
+        if self.gamma_lut is not None:
+            cv2.LUT(out, self.gamma_lut, dst=out)
+        return out
+
+    def apply(self, img, out=None, tiled=None):
+        if out is None:
+            out = np.empty_like(img)
+        if tiled is None:
+            tiled = should_tile(img)
+
+        if tiled:
+            self._apply_tiled(img, out)
+        else:
+            self.apply_local(img, out)
+            if self.equalize_hist:
+                equalize_luma(out, equalization_lut(luma_histogram(out)), out)
+
+        if self.channels == 4:
+            out[..., 3] = img[..., 3]
+        return out
+
+    # same stages on overlapping tiles; each worker only ever holds a tile-sized working set
+    def _apply_tiled(self, img, out):
+        height, width = img.shape[:2]
+
+        def local(inner, outer):
+            y0, y1, x0, x1 = inner
+            oy0, oy1, ox0, ox1 = outer
+            src = img[oy0:oy1, ox0:ox1]
+            tile = self.apply_local(src, _buffer("tile", src.shape))
+            out[y0:y1, x0:x1] = tile[y0 - oy0:y1 - oy0, x0 - ox0:x1 - ox0]
+
+        run_tiled(local, height, width, self.halo)
+        if not self.equalize_hist:
+            return out
+
+        def histogram(inner, outer):
+            y0, y1, x0, x1 = inner
+            return luma_histogram(out[y0:y1, x0:x1])
+
+        lut = equalization_lut(sum(run_tiled(histogram, height, width)))
+
+        def equalize(inner, outer):
+            y0, y1, x0, x1 = inner
+            region = out[y0:y1, x0:x1]
+            region[...] = equalize_luma(region, lut, _buffer("tile", region.shape))
+
+        run_tiled(equalize, height, width)
+        return out
+
+# enhance image quality
+# Matches the former PIL/OpenCV chain exactly on RGB input; alpha is carried through unchanged
+# rather than being dropped or filtered.
+# Large images are processed in tiles (bit-identical to the untiled path) unless `tiled` says otherwise.
+@timed("adjustments")
+def enhance_image_quality(img, brightness=1.0, contrast=1.0, saturation=1.0, sharpness=1.0, gamma=1.0, equalize_hist=False, tiled=None):
+    img = np.ascontiguousarray(img)
+    if tiled is None:
+        tiled = should_tile(img)
+    pipeline = AdjustmentPipeline(img, brightness, contrast, saturation, sharpness, gamma, equalize_hist, tiled)
+    return pipeline.apply(img, tiled=tiled)
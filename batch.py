@@ -0,0 +1,235 @@
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import time
+
+import cv2
+
+from adjustments import enhance_image_quality
+from compositing import FIT_MODES, composite
+from ingest import decode_image
+from matte_cache import apply_matte
+from segmentation import SEGMENTATION_MODEL, SegmentationEngine
+
+logger = logging.getLogger("batch")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+ADJUSTMENTS = ("brightness", "contrast", "saturation", "sharpness", "gamma", "equalize_hist")
+PRESET_KEYS = ADJUSTMENTS + ("remove_background", "background_color", "background_image", "background_fit")
+
+# named parameter sets; --preset also accepts a JSON file using the same keys.
+# background_image is a path or a list of paths, a list writes one variant per background
+PRESETS = {
+    "remove-background": {"remove_background": True},
+    "product-white": {"remove_background": True, "background_color": "#ffffff"},
+    "enhance": {"brightness": 1.1, "contrast": 1.1, "saturation": 1.1},
+    "demo": {"remove_background": True, "brightness": 0.82, "gamma": 1.29, "equalize_hist": True},
+}
+
+def load_preset(name):
+    if name in PRESETS:
+        preset = dict(PRESETS[name])
+    elif os.path.isfile(name):
+        with open(name) as f:
+            preset = json.load(f)
+    else:
+        raise ValueError(f"unknown preset {name!r}, expected one of {', '.join(PRESETS)} or a JSON file")
+    return validate_preset(preset)
+
+# reject bad presets up front instead of failing on every image; background_color comes back as an RGB tuple
+def validate_preset(preset):
+    unknown = set(preset) - set(PRESET_KEYS)
+    if unknown:
+        raise ValueError(f"unknown preset keys: {', '.join(sorted(unknown))}")
+    for key in ("background_image", "background_color"):
+        if preset.get(key) and not preset.get("remove_background"):
+            raise ValueError(f"{key} needs remove_background")
+    if preset.get("background_image") and preset.get("background_color"):
+        raise ValueError("background_image and background_color cannot be combined")
+    if preset.get("background_fit", "stretch") not in FIT_MODES:
+        raise ValueError(f"unknown background_fit {preset['background_fit']!r}, expected one of {', '.join(FIT_MODES)}")
+
+    color_code = preset.get("background_color")
+    if color_code:
+        if not isinstance(color_code, str) or not re.fullmatch(r"#[0-9a-fA-F]{6}", color_code):
+            raise ValueError(f"background_color must be a #rrggbb hex color, got {color_code!r}")
+        preset = dict(preset, background_color=tuple(int(color_code[i:i+2], 16) for i in (1, 3, 5)))
+    return preset
+
+def background_paths(preset):
+    paths = preset.get("background_image") or []
+    return [paths] if isinstance(paths, str) else list(paths)
+
+# leading directories of a glob pattern that contain no wildcards
+def glob_root(pattern):
+    parts = pattern.split(os.sep)
+    for i, part in enumerate(parts):
+        if any(c in part for c in "*?["):
+            return os.sep.join(parts[:i]) or (os.sep if pattern.startswith(os.sep) else ".")
+    return os.path.dirname(pattern) or "."
+
+# (path, output name) pairs; directory and glob inputs keep their layout below the directory or the
+# glob's fixed prefix, so same-named files in different folders never share an output
+def collect_inputs(patterns):
+    found = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                for name in files:
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        path = os.path.join(root, name)
+                        found.setdefault(os.path.abspath(path), os.path.relpath(path, pattern))
+        else:
+            if os.path.isfile(pattern):
+                paths, root = [pattern], os.path.dirname(pattern) or "."
+            else:
+                paths, root = glob.glob(pattern, recursive=True), glob_root(pattern)
+            for path in paths:
+                if path.lower().endswith(IMAGE_EXTENSIONS):
+                    found.setdefault(os.path.abspath(path), os.path.relpath(path, root))
+    return sorted(found.items())
+
+# inputs that would be written to the same output, e.g. x.jpg and x.png or the same name from two inputs
+def duplicate_outputs(inputs):
+    sources = {}
+    for path, name in inputs:
+        sources.setdefault(os.path.splitext(os.path.normcase(name))[0], []).append(path)
+    return [paths for paths in sources.values() if len(paths) > 1]
+
+# one output per background when there are several, named <image>-<background>.png
+def output_paths(output_dir, name, backgrounds=()):
+    stem = os.path.join(output_dir, os.path.splitext(name)[0])
+    if len(backgrounds) < 2:
+        return [stem + ".png"]
+    return [f"{stem}-{os.path.splitext(os.path.basename(path))[0]}.png" for path in backgrounds]
+
+def read_image(path):
+    with open(path, "rb") as f:
+        return decode_image(f.read())
+
+# write through a temp file so an interrupted run never leaves a truncated output behind
+def write_image(path, img):
+    code = cv2.COLOR_RGBA2BGRA if img.shape[2] == 4 else cv2.COLOR_RGB2BGR
+    ok, encoded = cv2.imencode(".png", cv2.cvtColor(img, code))
+    if not ok:
+        raise ValueError(f"cannot encode {path}")
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(encoded.tobytes())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+# the app's background removal, adjustment and compositing steps for one image with a validated preset,
+# returns one result per background image (a single one without backgrounds)
+def process_image(img, preset, engine=None, backgrounds=()):
+    if preset.get("remove_background"):
+        img = apply_matte(img, engine.predict_matte(img))
+
+    img = enhance_image_quality(img, **{key: preset[key] for key in ADJUSTMENTS if key in preset})
+
+    if preset.get("background_color"):
+        return composite(img, [preset["background_color"]])
+    if backgrounds:
+        # every variant comes out of one pass over the cutout
+        return composite(img, backgrounds, preset.get("background_fit", "stretch"))
+    return [img]
+
+_worker = {}
+
+# each worker process keeps one warm segmentation session for its whole life
+def _init_worker(preset, model_name, threads):
+    cv2.setNumThreads(1)
+    engine = None
+    if preset.get("remove_background"):
+        engine = SegmentationEngine(model_name, pool_size=1, intra_op_threads=threads)
+        engine.warm_up()
+    backgrounds = [read_image(path) for path in background_paths(preset)]
+    _worker.update(preset=preset, engine=engine, backgrounds=backgrounds)
+
+def _process(job):
+    src, dsts = job
+    start = time.perf_counter()
+    try:
+        imgs = process_image(read_image(src), _worker["preset"], _worker["engine"], _worker["backgrounds"])
+        for dst, img in zip(dsts, imgs):
+            write_image(dst, img)
+    except Exception as e:
+        return src, dsts, f"{type(e).__name__}: {e}", time.perf_counter() - start
+    return src, dsts, None, time.perf_counter() - start
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Apply background removal and image adjustments to many images.")
+    parser.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    parser.add_argument("-o", "--output", required=True, help="directory the processed PNGs are written to")
+    parser.add_argument("-p", "--preset", default="remove-background",
+                        help=f"one of {', '.join(PRESETS)} or a JSON file with the same keys")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--model", default=SEGMENTATION_MODEL, help="rembg model name")
+    parser.add_argument("--overwrite", action="store_true", help="reprocess images whose output already exists")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    try:
+        preset = load_preset(args.preset)
+    except (ValueError, OSError) as e:
+        logger.error(str(e))
+        return 2
+
+    inputs = collect_inputs(args.inputs)
+    duplicates = duplicate_outputs(inputs)
+    if duplicates:
+        for paths in duplicates:
+            logger.error("%s would all be written to the same output", ", ".join(paths))
+        return 2
+
+    backgrounds = background_paths(preset)
+    jobs = [(src, output_paths(args.output, name, backgrounds)) for src, name in inputs]
+    if not args.overwrite:
+        # resume: whatever finished before a crash is already on disk in full
+        jobs = [(src, dsts) for src, dsts in jobs if not all(os.path.exists(dst) for dst in dsts)]
+    skipped = len(inputs) - len(jobs)
+    logger.info("%d images found, %d already done, %d to process with preset %s",
+                len(inputs), skipped, len(jobs), args.preset)
+    if not jobs:
+        return 0
+
+    workers = max(1, min(args.workers, len(jobs)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    failed = 0
+    start = time.perf_counter()
+    # spawn, not fork: rembg pulls in numba, whose threading layer hangs forked pools on shutdown
+    context = multiprocessing.get_context("spawn")
+    # spawned workers read their tile pool size from the environment they inherit, so OpenCV, tiling and
+    # ONNX Runtime threads stay within each worker's share of the cores unless TILE_WORKERS is set explicitly
+    os.environ.setdefault("TILE_WORKERS", str(threads))
+    with context.Pool(workers, initializer=_init_worker, initargs=(preset, args.model, threads)) as pool:
+        for done, (src, dsts, error, seconds) in enumerate(pool.imap_unordered(_process, jobs), 1):
+            if error:
+                failed += 1
+                logger.error("[%d/%d] %s failed: %s", done, len(jobs), src, error)
+            else:
+                logger.info("[%d/%d] %s -> %s (%.2fs)", done, len(jobs), src, ", ".join(dsts), seconds)
+    elapsed = time.perf_counter() - start
+
+    processed = len(jobs) - failed
+    logger.info("%d processed, %d failed, %d skipped in %.1fs (%.2f images/s, %d workers)",
+                processed, failed, skipped, elapsed, processed / elapsed, workers)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from batch import collect_inputs, load_preset, process_image, validate_preset
+from cache import LRUCache
+from export import FORMATS, export_bytes
+from ingest import decode_image, probe
+from profiling import peak_rss_mb, record, summarize
+from segmentation import SEGMENTATION_MODEL, SegmentationEngine
+
+logger = logging.getLogger("benchmark")
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images")
+SYNTHETIC_MEGAPIXELS = (1, 12, 48)
+
+# the full-resolution path of Background Removal & Image Adjustment, with a color background
+DEFAULT_PRESET = {"remove_background": True, "brightness": 0.82, "gamma": 1.29, "equalize_hist": True,
+                  "background_color": "#00f900"}
+
+# stands in for the model with --skip-segmentation: a soft centered ellipse, so compositing still has edges to blend
+class SyntheticMatte:
+    model_name = "synthetic"
+
+    def predict_matte(self, img):
+        height, width = img.shape[:2]
+        matte = np.zeros((height, width), dtype=np.uint8)
+        cv2.ellipse(matte, (width // 2, height // 2), (width * 3 // 8, height * 3 // 8), 0, 0, 360, 255, -1)
+        return cv2.GaussianBlur(matte, (0, 0), max(1, width / 200))
+
+# a 4:3 JPEG of about `megapixels` with smooth gradients and sensor-like noise, so decoding and encoding see realistic data
+def synthetic_image(megapixels, seed=0):
+    width = round((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = round(width * 3 / 4)
+    rng = np.random.default_rng(seed)
+    y, x = np.ogrid[:height, :width]
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[..., 0] = (x * 255 // width).astype(np.uint8)
+    img[..., 1] = (y * 255 // height).astype(np.uint8)
+    img[..., 2] = 128
+    img += rng.integers(0, 16, img.shape, dtype=np.uint8)
+    ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    if not ok:
+        raise ValueError(f"cannot encode a {megapixels} MP synthetic image")
+    return encoded.tobytes()
+
+# (name, encoded bytes) for every sample image and synthetic size
+def benchmark_inputs(sample_dir, megapixels):
+    inputs = []
+    if sample_dir:
+        for path, name in collect_inputs([sample_dir]):
+            with open(path, "rb") as f:
+                inputs.append((name, f.read()))
+    for mp in megapixels:
+        inputs.append((f"synthetic-{mp:g}mp.jpg", synthetic_image(mp)))
+    return inputs
+
+# one upload through decode, segmentation, adjustments, compositing and encoding, nothing served from a cache
+def run_pipeline(data, preset, engine, format, max_width=None):
+    img = decode_image(data, max_width)
+    results = process_image(img, preset, engine)
+    for result in results:
+        export_bytes(lambda: result, "benchmark", format, cache=LRUCache(0))
+    return img
+
+# latency of the whole pipeline and of each stage over `repeat` timed runs, after `warmup` untimed ones
+def benchmark_image(name, data, preset, engine, format, repeat, warmup, max_width=None):
+    for _ in range(warmup):
+        run_pipeline(data, preset, engine, format, max_width)
+
+    totals, stages = [], {}
+    for _ in range(repeat):
+        with record() as timings:
+            img = run_pipeline(data, preset, engine, format, max_width)
+        totals.append(timings.elapsed())
+        for stage, seconds in timings.totals().items():
+            stages.setdefault(stage, []).append(seconds)
+
+    height, width = img.shape[:2]
+    result = {
+        "image": name,
+        "width": width,
+        "height": height,
+        "megapixels": round(width * height / 1e6, 2),
+        "encoded_bytes": len(data),
+        "total": summarize(totals),
+        "stages": {stage: summarize(seconds) for stage, seconds in stages.items()},
+        # high-water mark of the whole process so far
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    logger.info("%s %dx%d: p50 %.0f ms, p90 %.0f ms (%s), peak RSS %.0f MB", name, width, height,
+                result["total"]["p50_ms"], result["total"]["p90_ms"],
+                ", ".join(f"{stage} {s['p50_ms']:.0f}" for stage, s in result["stages"].items()),
+                result["peak_rss_mb"] or 0)
+    return result
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time the image pipeline on sample and synthetic images, offline.")
+    parser.add_argument("--images", default=SAMPLE_DIR, help="directory of sample images, '' to skip them")
+    parser.add_argument("--megapixels", type=float, nargs="*", default=list(SYNTHETIC_MEGAPIXELS),
+                        help="sizes of the synthetic images")
+    parser.add_argument("-p", "--preset", help="batch preset name or JSON file, defaults to the app's remove & adjust path")
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="timed runs per image")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs per image before timing")
+    parser.add_argument("--format", default="PNG", choices=list(FORMATS), help="export format")
+    parser.add_argument("--max-width", type=int, help="decode at most this wide, e.g. to time the preview path")
+    parser.add_argument("--model", default=SEGMENTATION_MODEL, help="rembg model name, must already be downloaded")
+    parser.add_argument("--skip-segmentation", action="store_true", help="use a synthetic matte instead of the model")
+    parser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stderr)
+    # one line per encode would drown the summaries
+    logging.getLogger("export").setLevel(logging.WARNING)
+
+    try:
+        preset = load_preset(args.preset) if args.preset else validate_preset(DEFAULT_PRESET)
+    except (ValueError, OSError) as e:
+        logger.error(str(e))
+        return 2
+    if preset.get("background_image"):
+        logger.error("background_image presets are not supported, use background_color")
+        return 2
+
+    engine = None
+    if preset.get("remove_background"):
+        if args.skip_segmentation:
+            engine = SyntheticMatte()
+        else:
+            engine = SegmentationEngine(args.model, pool_size=1)
+            engine.warm_up()
+
+    # smallest first, so each step up in peak RSS belongs to the image that caused it
+    inputs = sorted(benchmark_inputs(args.images, args.megapixels), key=lambda item: np.prod(probe(item[1])[0]))
+    logger.info("%d images, %d runs each, model %s", len(inputs), args.repeat, engine.model_name if engine else None)
+    start = time.perf_counter()
+    results = [benchmark_image(name, data, preset, engine, args.format, args.repeat, args.warmup, args.max_width)
+               for name, data in inputs]
+
+    report = {
+        "environment": environment(),
+        "settings": {
+            "preset": preset,
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+            "format": args.format,
+            "max_width": args.max_width,
+            "model": engine.model_name if engine else None,
+        },
+        "cold_starts": getattr(engine, "cold_starts", []),
+        "results": results,
+        "peak_rss_mb": peak_rss_mb(),
+        "seconds": time.perf_counter() - start,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
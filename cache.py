@@ -0,0 +1,70 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# content hash of a decoded image (shape and dtype included so equal bytes in another layout never collide)
+def image_key(img):
+    img = np.ascontiguousarray(img)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{img.shape}{img.dtype.str}".encode())
+    digest.update(img.data)
+    return digest.hexdigest()
+
+# digest of raw bytes, e.g. an upload before it is decoded
+def bytes_key(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+# memory held by a cached value: arrays report nbytes, encoded files are plain bytes
+def sizeof(value):
+    return value.nbytes if hasattr(value, "nbytes") else len(value)
+
+# in-memory LRU store evicted by the total size of its values
+class LRUCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    # values larger than the whole budget are never held
+    def _store(self, key, value):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= sizeof(old)
+        if sizeof(value) > self.max_bytes:
+            return
+        self._entries[key] = value
+        self.nbytes += sizeof(value)
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= sizeof(evicted)
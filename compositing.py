@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from cache import LRUCache, image_key
+from profiling import timed
+from tiling import run_tiled, should_tile, tile_boxes
+
+BACKGROUND_CACHE_BYTES = int(os.environ.get("BACKGROUND_CACHE_BYTES", 256 * 1024 * 1024))
+
+FIT_MODES = ("stretch", "cover", "contain")
+
+background_cache = LRUCache(BACKGROUND_CACHE_BYTES)
+
+# background resized to exactly `size` (width, height):
+# stretch ignores the aspect ratio, cover fills and crops the overflow, contain fits inside and pads with `fill`
+def _fit(background_image, size, fit, fill):
+    width, height = size
+    background = Image.fromarray(background_image).convert('RGB')
+    if fit == "stretch":
+        if background.size != size:
+            background = background.resize((int(width), int(height)), Image.LANCZOS)
+        return np.array(background)
+
+    b_width, b_height = background.size
+    scale = (max if fit == "cover" else min)(width / b_width, height / b_height)
+    scaled = (max(1, round(b_width * scale)), max(1, round(b_height * scale)))
+    if scaled != background.size:
+        background = background.resize(scaled, Image.LANCZOS)
+
+    left, top = (scaled[0] - width) // 2, (scaled[1] - height) // 2
+    if fit == "cover":
+        return np.array(background.crop((left, top, left + width, top + height)))
+    canvas = Image.new('RGB', size, fill)
+    canvas.paste(background, (-left, -top))
+    return np.array(canvas)
+
+# fitted backgrounds are cached per source, target size and fit mode, so reruns skip the resize
+def fit_background(background_image, size, fit="stretch", key=None, fill=(0, 0, 0), cache=background_cache):
+    if fit not in FIT_MODES:
+        raise ValueError(f"unknown fit mode {fit!r}, expected one of {', '.join(FIT_MODES)}")
+    cache_key = f"{key or image_key(background_image)}-{size[0]}x{size[1]}-{fit}-{fill}"
+    background = cache.get(cache_key)
+    if background is None:
+        background = _fit(background_image, size, fit, fill)
+        background.setflags(write=False)
+        cache.put(cache_key, background)
+    return background
+
+# One band of foreground over any number of backgrounds. The premultiplied foreground (fg * a) and
+# inverse alpha are computed once and reused for every background; the rounding is PIL's paste
+# blend, DIV255(fg * a + bg * (255 - a)), so results match Image.paste exactly. Everything fits in uint16.
+def _blend_band(foreground, backgrounds, outs):
+    alpha = foreground[..., 3:]
+    premultiplied = np.multiply(foreground[..., :3], alpha, dtype=np.uint16)
+    premultiplied += 128
+    # expanded to all three channels once, broadcasting a single channel per background is twice as slow
+    inverse = np.repeat(np.subtract(255, alpha, dtype=np.uint16), 3, axis=2)
+
+    blended = np.empty(premultiplied.shape, dtype=np.uint16)
+    shifted = np.empty(premultiplied.shape, dtype=np.uint16)
+    for background, out in zip(backgrounds, outs):
+        np.multiply(background, inverse, out=blended)
+        blended += premultiplied
+        np.right_shift(blended, 8, out=shifted)
+        blended += shifted
+        np.right_shift(blended, 8, out=blended)
+        out[...] = blended
+
+# An RGBA foreground over several backgrounds in one pass over the image. Each background is either
+# an RGB color tuple or an image, fitted to the foreground's size with `fit`; `keys` optionally name the
+# background images for the resize cache. Returns one RGB image per background.
+@timed("compositing")
+def composite(foreground, backgrounds, fit="stretch", keys=None, tiled=None):
+    height, width = foreground.shape[:2]
+    if foreground.ndim != 3 or foreground.shape[2] != 4:
+        # nothing to mask with, the foreground covers the whole background
+        return [foreground for _ in backgrounds]
+
+    layers = []
+    for i, background in enumerate(backgrounds):
+        if isinstance(background, tuple):
+            layers.append(np.array(background, dtype=np.uint8))
+        else:
+            key = keys[i] if keys else None
+            layers.append(fit_background(background, (width, height), fit, key))
+    outs = [np.empty((height, width, 3), dtype=np.uint8) for _ in backgrounds]
+
+    # bands bound the uint16 temporaries to the tile size, on the pool when the image is large
+    def blend(inner, outer):
+        y0, y1 = inner[:2]
+        _blend_band(foreground[y0:y1],
+                    [layer if layer.ndim == 1 else layer[y0:y1] for layer in layers],
+                    [out[y0:y1] for out in outs])
+
+    if tiled is None:
+        tiled = should_tile(foreground)
+    if tiled:
+        run_tiled(blend, height, width)
+    else:
+        for inner, outer in tile_boxes(height, width):
+            blend(inner, outer)
+    return outs
+
+# paste the enhanced cutout over a solid color or a background image
+def composite_background(enhanced_image, rgb_color=None, background_image=None, fit="stretch", background_key=None, tiled=None):
+    if rgb_color is not None:
+        return composite(enhanced_image, [tuple(rgb_color)], tiled=tiled)[0]
+    return composite(enhanced_image, [background_image], fit, [background_key], tiled)[0]
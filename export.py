@@ -0,0 +1,69 @@
+import io
+import logging
+import os
+import time
+
+from PIL import Image
+
+from cache import LRUCache
+from profiling import timed
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CACHE_BYTES = int(os.environ.get("EXPORT_CACHE_BYTES", 128 * 1024 * 1024))
+
+# mime type and file extension per output format
+FORMATS = {
+    "PNG": ("image/png", ".png"),
+    "JPEG": ("image/jpeg", ".jpg"),
+    "WEBP": ("image/webp", ".webp"),
+}
+
+export_cache = LRUCache(EXPORT_CACHE_BYTES)
+
+def mime_type(format):
+    return FORMATS[format][0]
+
+# swap whatever extension a name has for the one matching the format
+def export_filename(filename, format):
+    return os.path.splitext(filename)[0] + FORMATS[format][1]
+
+@timed("encode")
+def _encode(img, format, quality, optimize):
+    pil_img = Image.fromarray(img)
+    if format == "JPEG" and pil_img.mode == "RGBA":
+        # JPEG has no alpha channel, transparent areas become white
+        flattened = Image.new("RGB", pil_img.size, (255, 255, 255))
+        flattened.paste(pil_img, (0, 0), pil_img)
+        pil_img = flattened
+
+    if format == "PNG":
+        options = {"optimize": optimize}
+    elif format == "JPEG":
+        options = {"quality": quality, "optimize": optimize, "progressive": optimize}
+    else:
+        options = {"quality": quality, "method": 6 if optimize else 4}
+
+    buffered = io.BytesIO()
+    pil_img.save(buffered, format=format, **options)
+    return buffered.getvalue()
+
+# encoded file for whatever `render` returns, cached on `key` plus the encoder settings;
+# `render` only runs on a cache miss, so expensive full-resolution renders are skipped too
+def export_bytes(render, key, format="PNG", quality=90, optimize=False, cache=export_cache):
+    if format not in FORMATS:
+        raise ValueError(f"unsupported export format {format!r}, expected one of {', '.join(FORMATS)}")
+
+    if format == "PNG":
+        quality = None
+    cache_key = f"{key}-{format}-{quality}-{optimize}"
+    data = cache.get(cache_key)
+    if data is None:
+        img = render()
+        start = time.perf_counter()
+        data = _encode(img, format, quality, optimize)
+        logger.info("encoded %dx%d %s (quality=%s, optimize=%s): %d bytes in %.1f ms",
+                    img.shape[1], img.shape[0], format, quality, optimize, len(data),
+                    (time.perf_counter() - start) * 1000)
+        cache.put(cache_key, data)
+    return data
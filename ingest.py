@@ -0,0 +1,89 @@
+import io
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from cache import LRUCache, bytes_key
+from profiling import timed
+
+INGEST_CACHE_BYTES = int(os.environ.get("INGEST_CACHE_BYTES", 512 * 1024 * 1024))
+
+EXIF_ORIENTATION = 0x0112
+REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+decoded_cache = LRUCache(INGEST_CACHE_BYTES)
+
+# area-average downscale to at most `width` pixels wide, smaller images are returned as is
+def downscale(img, width):
+    height, full_width = img.shape[:2]
+    if width is None or full_width <= width:
+        return img
+    size = (width, max(1, round(height * width / full_width)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+# size, EXIF orientation and alpha of an encoded image, read from its header without decoding pixels
+def probe(data):
+    with Image.open(io.BytesIO(data)) as img:
+        orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+        has_alpha = "A" in img.getbands() or "transparency" in img.info
+        return img.size, orientation, has_alpha
+
+# the EXIF orientation tag applied the way PIL's exif_transpose does it
+def orient(img, orientation):
+    if orientation == 2:
+        return cv2.flip(img, 1)
+    if orientation == 3:
+        return cv2.rotate(img, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(img, 0)
+    if orientation == 5:
+        return cv2.transpose(img)
+    if orientation == 6:
+        return cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.rotate(cv2.transpose(img), cv2.ROTATE_180)
+    if orientation == 8:
+        return cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return img
+
+# decode to RGB (or RGBA when the file has transparency), upright, at most `max_width` pixels wide.
+# Opaque images use OpenCV's reduced decoding, which JPEG performs at DCT scale instead of resizing afterwards.
+@timed("decode")
+def decode_image(data, max_width=None):
+    (width, height), orientation, has_alpha = probe(data)
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+
+    flags = cv2.IMREAD_UNCHANGED if has_alpha else cv2.IMREAD_COLOR
+    if max_width is not None and not has_alpha:
+        for factor, reduced in REDUCED_FLAGS:
+            if width // factor >= max_width:
+                flags = reduced
+                break
+
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img is None:
+        raise ValueError("cannot decode image")
+
+    if img.dtype != np.uint8:
+        img = cv2.convertScaleAbs(img, alpha=255.0 / np.iinfo(img.dtype).max)
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+    elif img.shape[2] == 4:
+        cv2.cvtColor(img, cv2.COLOR_BGRA2RGBA, dst=img)
+    else:
+        cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
+
+    return downscale(orient(img, orientation), max_width)
+
+# decoded image memoized per upload content and target width, shared by every session
+def load_image(data, max_width=None, key=None, cache=decoded_cache):
+    cache_key = f"{key or bytes_key(data)}-{max_width}"
+    img = cache.get(cache_key)
+    if img is None:
+        img = decode_image(data, max_width)
+        img.setflags(write=False)
+        cache.put(cache_key, img)
+    return img
@@ -0,0 +1,171 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from profiling import current_recording, record, summarize
+from segmentation import SEGMENTATION_POOL_SIZE
+
+logger = logging.getLogger(__name__)
+
+# one worker per segmentation session plus one, so a long full-resolution render never holds up every upload
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", SEGMENTATION_POOL_SIZE + 1))
+JOB_QUEUE_LIMIT = int(os.environ.get("JOB_QUEUE_LIMIT", 32))
+# how long a finished job's result is kept for the session polling it
+JOB_RESULT_SECONDS = int(os.environ.get("JOB_RESULT_SECONDS", 600))
+# how long a page waits on a job before rerunning itself to poll again
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", 0.5))
+
+WAIT_SAMPLES = 1000
+
+# raised by submit when the queue is at JOB_QUEUE_LIMIT, callers retry later instead of piling on
+class QueueFull(Exception):
+    pass
+
+# one unit of work for a session; `kind` names the slot it occupies, `key` what it computes
+class Job:
+    def __init__(self, session, kind, key):
+        self.session = session
+        self.kind = kind
+        self.key = key
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.finished = None
+        self.future = None
+        # stages the job ran, handed to the first caller that collects the result
+        self.timings = None
+        self._report_lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.future.cancelled():
+            return "cancelled"
+        if self.future.done():
+            return "failed" if self.future.exception() is not None else "done"
+        return "queued" if self.started is None else "running"
+
+    def done(self):
+        return self.future.done()
+
+    # block up to `timeout` seconds, returns whether the job has finished
+    def wait(self, timeout=None):
+        wait([self.future], timeout)
+        return self.future.done()
+
+    # the job's return value; the first caller also gets its queue wait and stages added to whatever
+    # it is recording, so a rerun's breakdown covers the work it waited for on a job thread
+    def result(self, timeout=None):
+        value = self.future.result(timeout)
+        with self._report_lock:
+            timings, self.timings = self.timings, None
+        recording = current_recording()
+        if timings is not None and recording is not None:
+            recording.add("queue wait", self.started - self.submitted)
+            recording.merge(timings)
+        return value
+
+# Bounded pool running the heavy work of every session off the script thread. Each session holds at most
+# one job per kind: submitting the same key again returns the existing job, a different key cancels the
+# old one if it has not started yet (a running inference cannot be interrupted, its result is just ignored).
+class JobQueue:
+    def __init__(self, workers=JOB_WORKERS, limit=JOB_QUEUE_LIMIT, keep_seconds=JOB_RESULT_SECONDS):
+        self.workers = max(1, workers)
+        self.limit = limit
+        self.keep_seconds = keep_seconds
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="job")
+
+    def submit(self, session, kind, key, fn):
+        with self._lock:
+            self._prune()
+            job = self._jobs.get((session, kind))
+            if job is not None and job.key == key and job.state not in ("cancelled", "failed"):
+                return job
+            if job is not None:
+                self._cancel(job)
+            if self.queued >= self.limit:
+                self.rejected += 1
+                raise QueueFull(f"{self.queued} jobs queued, try again shortly")
+
+            job = Job(session, kind, key)
+            self.queued += 1
+            job.future = self._executor.submit(self._run, job, fn)
+            self._jobs[(session, kind)] = job
+            return job
+
+    # forget a finished job so its result is freed, e.g. once a download has been served
+    def discard(self, job):
+        with self._lock:
+            if self._jobs.get((job.session, job.kind)) is job:
+                del self._jobs[(job.session, job.kind)]
+
+    # queued jobs submitted before `job`, i.e. how many it is waiting behind
+    def position(self, job):
+        with self._lock:
+            return sum(1 for other in self._jobs.values()
+                       if other.started is None and not other.done() and other.submitted < job.submitted)
+
+    def stats(self):
+        with self._lock:
+            waits = list(self._waits)
+            return {
+                "workers": self.workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+                "rejected": self.rejected,
+                "wait": summarize(waits) if waits else None,
+            }
+
+    def _run(self, job, fn):
+        with self._lock:
+            job.started = time.perf_counter()
+            self.queued -= 1
+            self.running += 1
+            self._waits.append(job.started - job.submitted)
+        try:
+            with record() as job.timings:
+                return fn()
+        finally:
+            job.finished = time.perf_counter()
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+                queued = self.queued
+            logger.info("%s job waited %.0f ms, ran %.0f ms (%d queued)", job.kind,
+                        (job.started - job.submitted) * 1000, (job.finished - job.started) * 1000, queued)
+
+    # called with the lock held
+    def _cancel(self, job):
+        if job.future.cancel():
+            self.queued -= 1
+            self.cancelled += 1
+            logger.info("%s job superseded before it started", job.kind)
+
+    # called with the lock held; finished results nobody polled for in a while are dropped
+    def _prune(self):
+        now = time.perf_counter()
+        for slot, job in list(self._jobs.items()):
+            if job.finished is not None and now - job.finished > self.keep_seconds:
+                del self._jobs[slot]
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+# process-wide queue, built on first use
+def get_job_queue():
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
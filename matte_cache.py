@@ -0,0 +1,117 @@
+import os
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from cache import LRUCache, image_key
+from segmentation import get_engine
+
+# memory budget for cached mattes, and an optional directory that keeps them across restarts
+MATTE_CACHE_BYTES = int(os.environ.get("MATTE_CACHE_BYTES", 256 * 1024 * 1024))
+MATTE_CACHE_DIR = os.environ.get("MATTE_CACHE_DIR")
+MATTE_CACHE_DISK_BYTES = int(os.environ.get("MATTE_CACHE_DISK_BYTES", 2 * 1024 * 1024 * 1024))
+
+# alpha mattes in memory, with an optional on-disk tier that has its own byte budget
+class MatteCache(LRUCache):
+    def __init__(self, max_bytes=MATTE_CACHE_BYTES, disk_dir=None, disk_max_bytes=MATTE_CACHE_DISK_BYTES):
+        super().__init__(max_bytes)
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def __contains__(self, key):
+        return key in self._entries or (self.disk_dir is not None and os.path.exists(self._path(key)))
+
+    def get(self, key):
+        with self._lock:
+            matte = self._entries.get(key)
+            if matte is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return matte
+
+        matte = self._load(key)
+        with self._lock:
+            if matte is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, matte)
+        return matte
+
+    def put(self, key, matte):
+        matte = np.ascontiguousarray(matte, dtype=np.uint8)
+        matte.setflags(write=False)
+        super().put(key, matte)
+        self._save(key, matte)
+        return matte
+
+    # disk side: one .npy per matte, least recently used files go first when over budget
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.npy")
+
+    def _load(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            matte = np.load(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        matte.setflags(write=False)
+        return matte
+
+    def _save(self, key, matte):
+        if not self.disk_dir:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, matte)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._evict_disk()
+
+    def _evict_disk(self):
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".npy"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+matte_cache = MatteCache(MATTE_CACHE_BYTES, MATTE_CACHE_DIR)
+
+# same cutout rembg builds: the image composited over transparent black through the matte
+def apply_matte(img, matte):
+    img = Image.fromarray(img)
+    empty = Image.new("RGBA", img.size, 0)
+    return np.asarray(Image.composite(img, empty, Image.fromarray(matte)))
+
+# alpha matte for an image, segmented once per distinct content and model
+def get_matte(img, cache=matte_cache, engine=None, key=None):
+    engine = engine or get_engine()
+    key = f"{engine.model_name}-{key or image_key(img)}"
+    matte = cache.get(key)
+    if matte is None:
+        matte = cache.put(key, engine.predict_matte(img))
+    return matte
+
+# background removal that only pays for inference the first time an image is seen
+def remove_background(img, cache=matte_cache, engine=None, key=None):
+    img = np.asarray(img)
+    return apply_matte(img, get_matte(img, cache, engine, key))
@@ -0,0 +1,27 @@
+import os
+
+from cache import bytes_key
+from ingest import load_image
+
+# Streamlit's centered layout is ~704 css px wide; previews are rendered for 2x displays
+DISPLAY_WIDTH = int(os.environ.get("PREVIEW_DISPLAY_WIDTH", 704))
+PIXEL_RATIO = 2
+
+# pixel width a preview needs to fill one of `columns` side by side columns
+def preview_width(columns):
+    return DISPLAY_WIDTH * PIXEL_RATIO // columns
+
+# an upload's display-sized proxy that interactive edits run on; full resolution is decoded only when asked for
+class ProxyImage:
+    def __init__(self, data, width):
+        self.data = data
+        self.key = bytes_key(data)
+        self.preview_key = f"{self.key}-{width}"
+        self.preview = load_image(data, width, key=self.key)
+
+    @property
+    def full(self):
+        return load_image(self.data, key=self.key)
+
+def load_proxy(data, width):
+    return ProxyImage(data, width)
@@ -0,0 +1,97 @@
+import functools
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# show a per-stage timing breakdown of every rerun in the app's sidebar
+STAGE_TIMINGS = os.environ.get("STAGE_TIMINGS", "0") == "1"
+
+PERCENTILES = (50, 90, 99)
+
+_local = threading.local()
+
+# wall-clock seconds spent in each timed stage while recording, in the order the stages first ran
+class StageTimings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.calls = []
+
+    def add(self, stage, seconds):
+        self.calls.append((stage, seconds))
+
+    # stages another thread recorded on this one's behalf, e.g. a job it waited for
+    def merge(self, other):
+        self.calls.extend(other.calls)
+
+    def totals(self):
+        totals = {}
+        for stage, seconds in self.calls:
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        return totals
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+# start collecting the timed stages run by this thread, replacing whatever was being collected before
+def start_recording():
+    _local.timings = StageTimings()
+    return _local.timings
+
+# what this thread is currently recording into, None when it isn't
+def current_recording():
+    return getattr(_local, "timings", None)
+
+def stop_recording():
+    timings = getattr(_local, "timings", None)
+    _local.timings = None
+    return timings
+
+@contextmanager
+def record():
+    previous = getattr(_local, "timings", None)
+    timings = start_recording()
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+# time calls to the decorated function as `stage`; costs one attribute lookup when nothing is recording
+def timed(stage):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            timings = getattr(_local, "timings", None)
+            if timings is None:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timings.add(stage, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+# highest resident set size of this process so far, None where the platform has no getrusage
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+# latency summary in milliseconds of a list of durations in seconds
+def summarize(seconds, percentiles=PERCENTILES):
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    summary = {"runs": len(ms), "mean_ms": float(ms.mean()), "min_ms": float(ms.min()), "max_ms": float(ms.max())}
+    for p, value in zip(percentiles, np.percentile(ms, percentiles)):
+        summary[f"p{p}_ms"] = float(value)
+    return summary
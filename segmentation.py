@@ -0,0 +1,122 @@
+import inspect
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import onnxruntime as ort
+from rembg import new_session, remove
+
+from profiling import timed
+
+logger = logging.getLogger(__name__)
+
+# engine settings; an unset model name keeps rembg's own default
+SEGMENTATION_MODEL = os.environ.get("SEGMENTATION_MODEL") or inspect.signature(new_session).parameters["model_name"].default
+SEGMENTATION_POOL_SIZE = int(os.environ.get("SEGMENTATION_POOL_SIZE", max(1, (os.cpu_count() or 1) // 4)))
+SEGMENTATION_INTRA_OP_THREADS = int(os.environ.get("SEGMENTATION_INTRA_OP_THREADS", 0))
+SEGMENTATION_INTER_OP_THREADS = int(os.environ.get("SEGMENTATION_INTER_OP_THREADS", 1))
+
+# bounded pool of warm rembg sessions shared by every caller in the process
+class SegmentationEngine:
+    def __init__(self, model_name=SEGMENTATION_MODEL, pool_size=SEGMENTATION_POOL_SIZE,
+                 intra_op_threads=SEGMENTATION_INTRA_OP_THREADS, inter_op_threads=SEGMENTATION_INTER_OP_THREADS):
+        self.model_name = model_name
+        self.pool_size = max(1, pool_size)
+        # split the cores between sessions so concurrent inferences don't oversubscribe them
+        self.intra_op_threads = intra_op_threads or max(1, (os.cpu_count() or 1) // self.pool_size)
+        self.inter_op_threads = inter_op_threads
+        self.cold_starts = []
+        self.inferences = 0
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    # load every session up front so no user pays for model loading
+    def warm_up(self):
+        while self._reserve():
+            self._idle.put(self._create())
+
+    @property
+    def warm(self):
+        return self._created >= self.pool_size
+
+    def _reserve(self):
+        with self._lock:
+            if self._created >= self.pool_size:
+                return False
+            self._created += 1
+            return True
+
+    def _create(self):
+        try:
+            return self._new_session()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _new_session(self):
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = self.intra_op_threads
+        opts.inter_op_num_threads = self.inter_op_threads
+
+        start = time.perf_counter()
+        session = new_session(self.model_name, sess_opts=opts)
+        loaded = time.perf_counter()
+        # first run allocates the graph's buffers, count it as part of the cold start
+        remove(np.zeros((64, 64, 3), dtype=np.uint8), session=session, only_mask=True)
+        ready = time.perf_counter()
+
+        cold_start = {"load_seconds": loaded - start, "first_inference_seconds": ready - loaded}
+        self.cold_starts.append(cold_start)
+        logger.info("segmentation session %d/%d (%s) loaded in %.2fs, first inference %.2fs",
+                    len(self.cold_starts), self.pool_size, self.model_name,
+                    cold_start["load_seconds"], cold_start["first_inference_seconds"])
+        return session
+
+    # borrow a session, creating one lazily while the pool is below its bound
+    @contextmanager
+    def session(self):
+        try:
+            session = self._idle.get_nowait()
+        except queue.Empty:
+            session = self._create() if self._reserve() else self._idle.get()
+        try:
+            yield session
+        finally:
+            self._idle.put(session)
+
+    @timed("segmentation")
+    def predict_matte(self, img):
+        with self.session() as session:
+            matte = remove(img, session=session, only_mask=True)
+        with self._lock:
+            self.inferences += 1
+        return matte
+
+    def stats(self):
+        return {
+            "model": self.model_name,
+            "pool_size": self.pool_size,
+            "sessions": self._created,
+            "idle_sessions": self._idle.qsize(),
+            "intra_op_threads": self.intra_op_threads,
+            "inter_op_threads": self.inter_op_threads,
+            "inferences": self.inferences,
+            "cold_starts": list(self.cold_starts),
+        }
+
+_engine = None
+_engine_lock = threading.Lock()
+
+# process-wide engine, built on first use
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = SegmentationEngine()
+        return _engine
@@ -0,0 +1,41 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# images at least this large are processed tile by tile on the worker pool
+TILE_PIXELS = int(os.environ.get("TILE_PIXELS", 1024 * 1024))
+TILE_WORKERS = int(os.environ.get("TILE_WORKERS", os.cpu_count() or 1))
+TILED_MIN_PIXELS = int(os.environ.get("TILED_MIN_PIXELS", 8 * 1000 * 1000))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# one long-lived pool, so per-thread scratch buffers survive between calls
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=TILE_WORKERS, thread_name_prefix="tile")
+        return _executor
+
+def should_tile(img):
+    return img.shape[0] * img.shape[1] >= TILED_MIN_PIXELS
+
+# (inner, outer) boxes as (y0, y1, x0, x1); outer grows inner by `halo` rows, clipped to the image.
+# Tiles are full-width bands: OpenCV vectorizes row by row with a scalar tail whose rounding can differ,
+# so only whole rows reproduce the untiled result bit for bit.
+def tile_boxes(height, width, halo=0, tile_pixels=TILE_PIXELS):
+    rows = max(1, tile_pixels // max(width, 1))
+    boxes = []
+    for y0 in range(0, height, rows):
+        y1 = min(y0 + rows, height)
+        boxes.append(((y0, y1, 0, width), (max(y0 - halo, 0), min(y1 + halo, height), 0, width)))
+    return boxes
+
+# call fn(inner, outer) for every tile on the pool and return the results in tile order
+def run_tiled(fn, height, width, halo=0, tile_pixels=TILE_PIXELS):
+    boxes = tile_boxes(height, width, halo, tile_pixels)
+    if len(boxes) == 1:
+        return [fn(*boxes[0])]
+    futures = [_get_executor().submit(fn, inner, outer) for inner, outer in boxes]
+    return [future.result() for future in futures]